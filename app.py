@@ -1,12 +1,25 @@
 import os
 import json
+import asyncio
 import logging
+import functools
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from dotenv import load_dotenv
 from github_handler import GithubHandler
 from llm_analyzer import LLMAnalyzer
 from github_commenter import GithubCommenter
+from github_rate_limiter import GithubRateLimiter
+
+# orjson encodes and decodes webhook payloads several times faster than the
+# standard library
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Load environment variables
 load_dotenv()
@@ -17,7 +30,38 @@ logging.basicConfig(
     format='[%(asctime)s] %(levelname)s in %(module)s: %(message)s',
 )
 
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by orjson, used for request.json and jsonify
+    """
+    
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+
+# Pull requests are processed in the background so webhooks are acknowledged
+# well within GitHub's 10 second delivery timeout
+executor = ThreadPoolExecutor(max_workers=int(os.getenv('WORKERS', '4')))
+
+# All async work runs on one long-lived event loop, so the shared components'
+# async clients keep their connection pools (and the LLM concurrency limit
+# covers every pull request in this worker process) across webhooks
+event_loop = asyncio.new_event_loop()
+threading.Thread(target=event_loop.run_forever, name='pr-agent-event-loop', daemon=True).start()
+
+# Guards construction of the shared components below
+components_lock = threading.Lock()
 
 @app.route('/')
 def index():
@@ -38,10 +82,10 @@ def webhook():
                 pr_number = payload['pull_request']['number']
                 repo_name = payload['repository']['full_name']
                 
-                # Process the pull request
-                process_pull_request(repo_name, pr_number)
+                # Queue the pull request for processing
+                executor.submit(process_pull_request_in_background, repo_name, pr_number)
                 
-                return jsonify({'status': 'success', 'message': f'Processing PR #{pr_number}'})
+                return jsonify({'status': 'accepted', 'message': f'Processing PR #{pr_number}'}), 202
             except Exception as e:
                 app.logger.error(f"Error processing webhook: {str(e)}")
                 app.logger.error(f"Stack trace: {traceback.format_exc()}")
@@ -49,6 +93,37 @@ def webhook():
         
         return jsonify({'status': 'ignored', 'message': 'Not a relevant PR event'})
 
+def process_pull_request_in_background(repo_name, pr_number):
+    """
+    Run process_pull_request on a worker thread, logging any failure since
+    there is no request left to report it to
+    """
+    try:
+        process_pull_request(repo_name, pr_number)
+    except Exception as e:
+        app.logger.error(f"Error processing PR #{pr_number} in {repo_name}: {str(e)}")
+        app.logger.error(f"Stack trace: {traceback.format_exc()}")
+
+@functools.lru_cache(maxsize=4)
+def get_github_rate_limiter(github_token):
+    """Get the GithubRateLimiter shared by everything using a GitHub token's quota"""
+    return GithubRateLimiter()
+
+@functools.lru_cache(maxsize=4)
+def get_github_handler(github_token):
+    """Get the shared GithubHandler for a GitHub token"""
+    return GithubHandler(github_token, rate_limiter=get_github_rate_limiter(github_token))
+
+@functools.lru_cache(maxsize=4)
+def get_github_commenter(github_token):
+    """Get the shared GithubCommenter for a GitHub token"""
+    return GithubCommenter(github_token, rate_limiter=get_github_rate_limiter(github_token))
+
+@functools.lru_cache(maxsize=4)
+def get_llm_analyzer(llm_provider, api_key):
+    """Get the shared LLMAnalyzer for an LLM provider and API key"""
+    return LLMAnalyzer(api_key)
+
 def process_pull_request(repo_name, pr_number):
     """
     Process a pull request by:
@@ -56,9 +131,6 @@ def process_pull_request(repo_name, pr_number):
     2. Analyzing the diffs with an LLM
     3. Posting comments back to GitHub
     """
-    # Initialize components
-    github_handler = GithubHandler(os.getenv('GITHUB_TOKEN'))
-    
     # Get the appropriate API key based on the LLM provider
     llm_provider = os.getenv('LLM_PROVIDER', 'openai').lower()
     if llm_provider == 'openai':
@@ -69,26 +141,44 @@ def process_pull_request(repo_name, pr_number):
     if not api_key:
         raise ValueError(f"API key for {llm_provider} not provided. Set LLM_API_KEY environment variable.")
     
-    llm_analyzer = LLMAnalyzer(api_key)
-    github_commenter = GithubCommenter(os.getenv('GITHUB_TOKEN'))
+    # Components are built once and reused by every webhook
+    with components_lock:
+        github_handler = get_github_handler(os.getenv('GITHUB_TOKEN'))
+        llm_analyzer = get_llm_analyzer(llm_provider, api_key)
+        github_commenter = get_github_commenter(os.getenv('GITHUB_TOKEN'))
+    
+    future = asyncio.run_coroutine_threadsafe(
+        review_pull_request(github_handler, llm_analyzer, github_commenter, repo_name, pr_number),
+        event_loop
+    )
+    future.result()
+
+async def review_pull_request(github_handler, llm_analyzer, github_commenter, repo_name, pr_number):
+    """
+    Stream the PR diffs through the LLM and post the resulting review
+    """
+    # Cached PR objects are only valid for this run; per-run copies keep
+    # concurrent webhooks for the same PR (e.g. quick successive pushes) from
+    # reusing or clearing each other's objects
+    github_handler = github_handler.for_run()
+    github_commenter = github_commenter.for_run()
     
-    # Get PR diffs
-    diffs = github_handler.get_pr_diffs(repo_name, pr_number)
+    # Stream PR diffs file by file
+    diffs = github_handler.iter_pr_diffs(repo_name, pr_number)
     
-    # Analyze diffs with LLM
-    analysis_results = llm_analyzer.analyze_diffs(diffs)
+    # Analyze diffs with LLM concurrently, starting each request as soon
+    # as its files have been downloaded
+    analysis_results = await llm_analyzer.analyze_diffs_async(diffs)
     
-    # Post comments back to GitHub
-    for file_path, comments in analysis_results.items():
-        for comment in comments:
-            github_commenter.post_comment(
-                repo_name, 
-                pr_number, 
-                file_path, 
-                comment['line'], 
-                comment['content']
-            )
+    # Post comments back to GitHub as a single review
+    review_comments = [
+        {'path': file_path, 'line': comment['line'], 'body': comment['content']}
+        for file_path, comments in analysis_results.items()
+        for comment in comments
+    ]
+    await github_commenter.post_review_batch(repo_name, pr_number, review_comments)
 
 if __name__ == '__main__':
+    # Development server only; in production run under gunicorn (see README)
     port = int(os.getenv('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    app.run(host='0.0.0.0', port=port, debug=os.getenv('FLASK_DEBUG') == '1')
@@ -0,0 +1,5 @@
+import re
+
+# Hunk header of a unified diff: @@ -old_start,old_count +new_start,new_count @@
+# Multiline, so it can both scan a whole diff with finditer and match a single line
+HUNK_RE = re.compile(r'(?m)^@@ -(\d+)(?:,\d+)? \+(\d+)(?:,\d+)? @@')
@@ -1,21 +1,132 @@
 import os
+import copy
+import asyncio
+import httpx
 from github import Github
 from github.GithubException import GithubException
+from github_rate_limiter import GithubRateLimiter
+from diff_utils import HUNK_RE
+
+GITHUB_GRAPHQL_URL = 'https://api.github.com/graphql'
+
+# Creates a single review carrying every inline comment
+ADD_PULL_REQUEST_REVIEW_MUTATION = """
+mutation($pullRequestId: ID!, $commitOID: GitObjectID, $comments: [DraftPullRequestReviewComment]) {
+  addPullRequestReview(input: {pullRequestId: $pullRequestId, commitOID: $commitOID, event: COMMENT, comments: $comments}) {
+    pullRequestReview {
+      id
+    }
+  }
+}
+"""
 
 class GithubCommenter:
     """
     Posts comments to GitHub pull requests
     """
     
-    def __init__(self, github_token):
+    def __init__(self, github_token, rate_limiter=None):
         """
         Initialize with GitHub token
         
         Args:
             github_token (str): GitHub personal access token
+            rate_limiter (GithubRateLimiter): Rate limiter shared with every other
+                user of the token's quota; a private one is created if omitted
         """
         self.github_token = github_token
         self.github = Github(github_token)
+        
+        # Pooled HTTP/2 client for GraphQL calls; a review carrying many
+        # comments takes a while, so reads get a longer timeout than httpx's
+        # 5s default
+        self.http_client = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(10.0, read=float(os.getenv('GITHUB_READ_TIMEOUT', '60'))),
+            limits=httpx.Limits(max_keepalive_connections=32),
+            headers={'Authorization': f'bearer {github_token}'}
+        )
+        
+        # Paces both the PyGithub calls and the httpx requests
+        self.rate_limiter = rate_limiter or GithubRateLimiter()
+        
+        # Per pull request caches keyed by (repo_name, pr_number), so posting
+        # many comments does not refetch the same objects for every comment;
+        # only valid for one run, see for_run
+        self._pr_cache = {}
+        self._position_index_cache = {}
+        self._last_commit_cache = {}
+    
+    def _get_pull_request(self, repo_name, pr_number):
+        """
+        Get a pull request, fetching it at most once
+        
+        Args:
+            repo_name (str): Repository name in format 'owner/repo'
+            pr_number (int): Pull request number
+            
+        Returns:
+            github.PullRequest.PullRequest: Pull request object
+        """
+        key = (repo_name, pr_number)
+        if key not in self._pr_cache:
+            self.rate_limiter.wait_for_github(self.github)
+            repo = self.github.get_repo(repo_name)
+            self._pr_cache[key] = repo.get_pull(pr_number)
+        return self._pr_cache[key]
+    
+    def _get_position_index(self, repo_name, pr_number):
+        """
+        Get the diff position index for a pull request, building it at most once
+        
+        Args:
+            repo_name (str): Repository name in format 'owner/repo'
+            pr_number (int): Pull request number
+            
+        Returns:
+            dict: Position index as returned by _build_position_index
+        """
+        key = (repo_name, pr_number)
+        if key not in self._position_index_cache:
+            pull_request = self._get_pull_request(repo_name, pr_number)
+            self.rate_limiter.wait_for_github(self.github)
+            self._position_index_cache[key] = self._build_position_index(pull_request)
+        return self._position_index_cache[key]
+    
+    def _get_last_commit(self, repo_name, pr_number):
+        """
+        Get the last commit in a pull request, fetching it at most once
+        
+        Args:
+            repo_name (str): Repository name in format 'owner/repo'
+            pr_number (int): Pull request number
+            
+        Returns:
+            github.Commit.Commit: Last commit in the pull request
+        """
+        key = (repo_name, pr_number)
+        if key not in self._last_commit_cache:
+            pull_request = self._get_pull_request(repo_name, pr_number)
+            self.rate_limiter.wait_for_github(self.github)
+            self._last_commit_cache[key] = pull_request.get_commits().get_page(0)[-1]
+        return self._last_commit_cache[key]
+    
+    def for_run(self):
+        """
+        Get a commenter for processing a single webhook
+        
+        The copy shares this commenter's clients and rate limiter but has its
+        own caches, so concurrent runs on the same pull request never see each
+        other's pull request, head commit or diff positions.
+        
+        Returns:
+            GithubCommenter: Commenter with empty caches
+        """
+        run = copy.copy(self)
+        run._pr_cache = {}
+        run._position_index_cache = {}
+        run._last_commit_cache = {}
+        return run
     
     def post_comment(self, repo_name, pr_number, file_path, line_number, comment_text):
         """
@@ -32,18 +143,21 @@ class GithubCommenter:
             bool: True if comment was posted successfully, False otherwise
         """
         try:
-            # Get repository and pull request
-            repo = self.github.get_repo(repo_name)
-            pull_request = repo.get_pull(pr_number)
+            # Get pull request
+            pull_request = self._get_pull_request(repo_name, pr_number)
+            
+            commit = self._get_last_commit(repo_name, pr_number)
+            position = self._get_position_in_diff(repo_name, pr_number, file_path, line_number)
             
             # Create a review comment
             # Note: This requires the PR to have been created with a diff
             # and the line number must be in the diff
+            self.rate_limiter.wait_for_github(self.github)
             pull_request.create_review_comment(
                 body=comment_text,
-                commit=pull_request.get_commits().get_page(0)[-1],  # Last commit in the PR
+                commit=commit,
                 path=file_path,
-                position=self._get_position_in_diff(pull_request, file_path, line_number)
+                position=position
             )
             
             return True
@@ -59,55 +173,187 @@ class GithubCommenter:
                 print(f"Failed to post fallback comment: {str(e2)}")
                 return False
     
-    def _get_position_in_diff(self, pull_request, file_path, line_number):
+    async def post_review_batch(self, repo_name, pr_number, comments):
+        """
+        Post all review comments on a pull request as a single review
+        
+        Uses one GraphQL addPullRequestReview mutation instead of one REST call
+        per comment. Falls back to posting comments one by one only if GitHub
+        rejects the review; if the outcome of the request is unknown (e.g. a
+        timeout), nothing is re-posted, so comments are never duplicated.
+        
+        Args:
+            repo_name (str): Repository name in format 'owner/repo'
+            pr_number (int): Pull request number
+            comments (list): List of dicts with 'path', 'line' and 'body' keys
+            
+        Returns:
+            bool: True if all comments were posted successfully, False otherwise
+        """
+        if not comments:
+            return True
+        
+        try:
+            # PyGithub is blocking, so keep it off the event loop
+            pull_request = await asyncio.to_thread(self._get_pull_request, repo_name, pr_number)
+            await asyncio.to_thread(self._get_position_index, repo_name, pr_number)
+        except Exception as e:
+            print(f"Failed to prepare review batch: {str(e)}")
+            return False
+        
+        draft_comments = []
+        placed_comments = []
+        unplaced_comments = []
+        for comment in comments:
+            try:
+                position = self._get_position_in_diff(repo_name, pr_number, comment['path'], comment['line'])
+            except Exception:
+                unplaced_comments.append(comment)
+                continue
+            placed_comments.append(comment)
+            draft_comments.append({
+                'path': comment['path'],
+                'position': position,
+                'body': comment['body']
+            })
+        
+        success = True
+        response = None
+        if draft_comments:
+            try:
+                response = await self.rate_limiter.send(
+                    self.http_client,
+                    'POST',
+                    GITHUB_GRAPHQL_URL,
+                    resource='graphql',
+                    json={
+                        'query': ADD_PULL_REQUEST_REVIEW_MUTATION,
+                        'variables': {
+                            # The node ID comes with the cached pull request, so it
+                            # does not need a separate GraphQL lookup
+                            'pullRequestId': pull_request.raw_data['node_id'],
+                            'commitOID': pull_request.head.sha,
+                            'comments': draft_comments
+                        }
+                    }
+                )
+            except Exception as e:
+                # The review may have been created before the connection failed
+                print(f"Failed to post review batch, not retrying as it may have been posted: {str(e)}")
+                success = False
+        
+        result = {}
+        if response is not None and response.status_code == 200:
+            try:
+                result = response.json()
+            except ValueError:
+                print("Failed to read review batch response, not retrying as it may have been posted")
+                response = None
+                success = False
+        
+        if response is not None:
+            if response.status_code != 200 or result.get('errors'):
+                print(f"Failed to post review batch: {response.status_code} {result.get('errors')}")
+                
+                # Fallback: Post the comments one at a time
+                for comment in placed_comments:
+                    try:
+                        posted = await asyncio.to_thread(
+                            self.post_comment, repo_name, pr_number, comment['path'], comment['line'], comment['body']
+                        )
+                    except Exception as e:
+                        print(f"Failed to post comment: {str(e)}")
+                        posted = False
+                    success = success and posted
+        
+        # Comments on lines outside the diff can only go in as regular PR comments
+        for comment in unplaced_comments:
+            try:
+                await asyncio.to_thread(
+                    self._post_fallback_comment, repo_name, pr_number, comment['path'], comment['line'], comment['body']
+                )
+            except Exception as e:
+                print(f"Failed to post fallback comment: {str(e)}")
+                success = False
+        
+        return success
+    
+    async def aclose(self):
+        """
+        Close the pooled HTTP client
+        """
+        await self.http_client.aclose()
+    
+    def _get_position_in_diff(self, repo_name, pr_number, file_path, line_number):
         """
         Get the position in the diff for a specific line number
         
         Args:
-            pull_request: GitHub pull request object
+            repo_name (str): Repository name in format 'owner/repo'
+            pr_number (int): Pull request number
             file_path (str): Path to the file
             line_number (int): Line number in the file
             
         Returns:
             int: Position in the diff
         """
-        # Get the diff for the file
-        files = pull_request.get_files()
-        for file in files:
-            if file.filename == file_path:
-                # Parse the patch to find the position
-                patch_lines = file.patch.split('\n')
-                position = 0
-                current_line = 0
+        position_index = self._get_position_index(repo_name, pr_number)
+        if file_path not in position_index:
+            # If we couldn't find the file, raise an exception
+            raise Exception(f"File {file_path} not found in the pull request")
+        
+        positions, last_position = position_index[file_path]
+        
+        # If we couldn't find the exact line, return the position at the end of the file
+        return positions.get(line_number, last_position)
+    
+    def _build_position_index(self, pull_request):
+        """
+        Map every commentable line of every file in the pull request to its diff position
+        
+        Each file's patch is walked once, so looking up a comment's position is
+        a dictionary access rather than a rescan of every patch.
+        
+        Args:
+            pull_request: GitHub pull request object
+            
+        Returns:
+            dict: File paths mapped to a (positions, last_position) tuple, where
+                positions maps new-file line numbers to diff positions
+        """
+        position_index = {}
+        
+        for file in pull_request.get_files():
+            # Binary files have no patch
+            patch_lines = (file.patch or '').split('\n')
+            positions = {}
+            position = 0
+            current_line = 0
+            
+            for patch_line in patch_lines:
+                position += 1
+                
+                # The line type is fully determined by its first character
+                first = patch_line[:1]
                 
-                for patch_line in patch_lines:
-                    position += 1
-                    
-                    # Skip diff headers
-                    if patch_line.startswith('@@'):
-                        # Extract the starting line number
-                        # Format: @@ -old_start,old_count +new_start,new_count @@
-                        parts = patch_line.split(' ')
-                        if len(parts) >= 3:
-                            new_info = parts[2]
-                            if ',' in new_info:
-                                current_line = int(new_info[1:].split(',')[0])
-                            else:
-                                current_line = int(new_info[1:])
-                        continue
-                    
-                    # Track line numbers for additions and context lines
-                    if patch_line.startswith('+') or not patch_line.startswith('-'):
-                        if current_line == line_number:
-                            return position
-                        if not patch_line.startswith('\\'):  # Ignore "\ No newline at end of file"
-                            current_line += 1
+                # Skip diff headers
+                if first == '@':
+                    # Extract the starting line number of the new file
+                    match = HUNK_RE.match(patch_line)
+                    if match:
+                        current_line = int(match.group(2))
+                    continue
                 
-                # If we couldn't find the exact line, return the position at the end of the file
-                return position
+                # Track line numbers for additions and context lines
+                if first == '\\':  # Ignore "\ No newline at end of file"
+                    continue
+                if first != '-':
+                    positions.setdefault(current_line, position)
+                    current_line += 1
+            
+            position_index[file.filename] = (positions, position)
         
-        # If we couldn't find the file, raise an exception
-        raise Exception(f"File {file_path} not found in the pull request")
+        return position_index
     
     def _post_fallback_comment(self, repo_name, pr_number, file_path, line_number, comment_text):
         """
@@ -120,13 +366,13 @@ class GithubCommenter:
             line_number (int): Line number to comment on
             comment_text (str): Comment text
         """
-        repo = self.github.get_repo(repo_name)
-        pull_request = repo.get_pull(pr_number)
+        pull_request = self._get_pull_request(repo_name, pr_number)
         
         # Format the comment to include file and line information
         formatted_comment = f"**{file_path}:{line_number}**\n\n{comment_text}"
         
         # Post a regular comment on the PR
+        self.rate_limiter.wait_for_github(self.github)
         pull_request.create_issue_comment(formatted_comment)
     
     def post_summary_comment(self, repo_name, pr_number, summary_text):
@@ -142,10 +388,10 @@ class GithubCommenter:
             bool: True if comment was posted successfully, False otherwise
         """
         try:
-            repo = self.github.get_repo(repo_name)
-            pull_request = repo.get_pull(pr_number)
+            pull_request = self._get_pull_request(repo_name, pr_number)
             
             # Post a regular comment on the PR
+            self.rate_limiter.wait_for_github(self.github)
             pull_request.create_issue_comment(summary_text)
             
             return True
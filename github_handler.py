@@ -1,27 +1,55 @@
 import os
-import requests
+import re
+import copy
+import asyncio
+import httpx
 import traceback
 from github import Github
 from github.GithubException import GithubException
+from github_rate_limiter import GithubRateLimiter
+from diff_utils import HUNK_RE
+
+# Per-file header of a unified diff: diff --git a/path/to/file b/path/to/file
+_FILE_HEADER_RE = re.compile(r'(?m)^diff --git a/(.+?) b/(.+)$')
 
 class GithubHandler:
     """
     Handles interactions with GitHub API to fetch PR details and diffs
     """
     
-    def __init__(self, github_token):
+    def __init__(self, github_token, rate_limiter=None):
         """
         Initialize with GitHub token
         
         Args:
             github_token (str): GitHub personal access token
+            rate_limiter (GithubRateLimiter): Rate limiter shared with every other
+                user of the token's quota; a private one is created if omitted
         """
         self.github_token = github_token
         self.github = Github(github_token)
+        
+        # Pooled HTTP/2 client for raw diff downloads; diff URLs redirect to
+        # GitHub's diff host, so redirects must be followed. Large diffs take a
+        # while to stream, so reads get a longer timeout than httpx's 5s default
+        self.http_client = httpx.AsyncClient(
+            http2=True,
+            follow_redirects=True,
+            timeout=httpx.Timeout(10.0, read=float(os.getenv('GITHUB_READ_TIMEOUT', '60'))),
+            limits=httpx.Limits(max_keepalive_connections=32),
+            headers={'Authorization': f'token {github_token}'}
+        )
+        
+        # Paces both the PyGithub calls and the httpx requests
+        self.rate_limiter = rate_limiter or GithubRateLimiter()
+        
+        # Pull request objects keyed by (repo_name, pr_number); only valid for
+        # one run, see for_run
+        self._pr_cache = {}
     
     def get_pr_details(self, repo_name, pr_number):
         """
-        Get pull request details
+        Get pull request details, fetching them at most once per pull request
         
         Args:
             repo_name (str): Repository name in format 'owner/repo'
@@ -30,15 +58,36 @@ class GithubHandler:
         Returns:
             github.PullRequest.PullRequest: Pull request object
         """
+        key = (repo_name, pr_number)
+        if key in self._pr_cache:
+            return self._pr_cache[key]
+        
         try:
+            self.rate_limiter.wait_for_github(self.github)
             repo = self.github.get_repo(repo_name)
             pull_request = repo.get_pull(pr_number)
+            self._pr_cache[key] = pull_request
             return pull_request
         except GithubException as e:
             traceback.print_exc()
             raise e
     
-    def get_pr_diffs(self, repo_name, pr_number):
+    def for_run(self):
+        """
+        Get a handler for processing a single webhook
+        
+        The copy shares this handler's clients and rate limiter but has its own
+        pull request cache, so concurrent runs on the same pull request never
+        see each other's objects.
+        
+        Returns:
+            GithubHandler: Handler with an empty cache
+        """
+        run = copy.copy(self)
+        run._pr_cache = {}
+        return run
+    
+    async def get_pr_diffs(self, repo_name, pr_number):
         """
         Get pull request diffs
         
@@ -49,139 +98,205 @@ class GithubHandler:
         Returns:
             dict: Dictionary with file paths as keys and diff content as values
         """
+        return {file_path: diff_info async for file_path, diff_info in self.iter_pr_diffs(repo_name, pr_number)}
+    
+    async def iter_pr_diffs(self, repo_name, pr_number):
+        """
+        Stream pull request diffs, yielding each file as soon as it has been downloaded
+        
+        Only the diff of the file currently being received is held in memory.
+        
+        Args:
+            repo_name (str): Repository name in format 'owner/repo'
+            pr_number (int): Pull request number
+            
+        Yields:
+            tuple: (file_path, diff_info) pairs in diff order
+        """
         try:
-            # Get PR details
-            pull_request = self.get_pr_details(repo_name, pr_number)
+            # Get PR details; PyGithub is blocking, so keep it off the event loop
+            pull_request = await asyncio.to_thread(self.get_pr_details, repo_name, pr_number)
             
             # Get diff content using the diff_url
             diff_url = pull_request.diff_url
-            headers = {'Authorization': f'token {self.github_token}'}
-            response = requests.get(diff_url, headers=headers)
-            
-            if response.status_code != 200:
-                raise Exception(f"Failed to get PR diff: {response.status_code} {diff_url} {self.github_token} {repo_name} {pr_number}")
-            
-            # Parse the diff content
-            diff_content = response.text
-            
-            # Process the diff to extract per-file changes
-            return self._parse_diff_content(diff_content)
+            # Raw diffs are served outside the API quota, so the download is
+            # never paused, only retried if GitHub rejects it
+            response = await self.rate_limiter.send(self.http_client, 'GET', diff_url, stream=True)
+            try:
+                if response.status_code != 200:
+                    raise Exception(f"Failed to get PR diff: {response.status_code} {diff_url} {repo_name} {pr_number}")
+                
+                async for parsed in self._parse_diff_stream(response.aiter_text()):
+                    yield parsed
+            finally:
+                await response.aclose()
             
         except Exception as e:
             traceback.print_exc()
             raise e
     
-    def _parse_diff_content(self, diff_content):
+    async def aclose(self):
+        """
+        Close the pooled HTTP client
+        """
+        await self.http_client.aclose()
+    
+    async def _parse_diff_stream(self, chunks):
         """
-        Parse the raw diff content into a structured format
+        Parse a stream of raw diff text into per-file structured diffs
+        
+        Each chunk is cut at the file headers it contains, so a file's diff is
+        assembled from a few large slices rather than from individual lines.
         
         Args:
-            diff_content (str): Raw diff content from GitHub
+            chunks (async iterable): Raw diff text in arbitrarily sized chunks
             
-        Returns:
-            dict: Dictionary with file paths as keys and structured diff info as values
+        Yields:
+            tuple: (file_path, diff_info) pairs
         """
-        diffs = {}
-        current_file = None
-        current_diff_lines = []
+        file_parts = []
         
-        # Split the diff content by lines
-        lines = diff_content.split('\n')
+        # Incomplete last line of the previous chunk; a header can only be
+        # recognised once its line is complete
+        pending = ''
         
-        for line in lines:
-            # Check if this is a new file diff
-            if line.startswith('diff --git'):
-                # Save the previous file diff if exists
-                if current_file and current_diff_lines:
-                    diffs[current_file] = {
-                        'content': '\n'.join(current_diff_lines),
-                        'changes': self._extract_line_changes(current_diff_lines)
-                    }
+        async for chunk in chunks:
+            text = pending + chunk
+            complete = text.rfind('\n') + 1
+            pending = text[complete:]
+            
+            # A new file header completes the previous file; the newline in
+            # front of the header is left out of the previous file's diff
+            start = 0
+            header = self._find_file_header(text, 0, complete)
+            while header >= 0:
+                if header > start:
+                    file_parts.append(text[start:header - 1])
+                elif file_parts:
+                    file_parts[-1] = file_parts[-1][:-1]
                 
-                # Extract the new file path
-                # The format is typically: diff --git a/path/to/file b/path/to/file
-                parts = line.split(' ')
-                if len(parts) >= 4:
-                    # Use the b/path/to/file and remove the b/ prefix
-                    current_file = parts[3][2:]
-                    current_diff_lines = [line]
-            elif current_file:
-                current_diff_lines.append(line)
+                parsed = self._parse_file_diff(''.join(file_parts)) if file_parts else None
+                if parsed:
+                    yield parsed
+                file_parts = []
+                start = header
+                header = self._find_file_header(text, header + 1, complete)
+            
+            if complete > start:
+                file_parts.append(text[start:complete])
         
         # Add the last file diff
-        if current_file and current_diff_lines:
-            diffs[current_file] = {
-                'content': '\n'.join(current_diff_lines),
-                'changes': self._extract_line_changes(current_diff_lines)
-            }
+        if pending:
+            file_parts.append(pending)
+        elif file_parts:
+            file_parts[-1] = file_parts[-1][:-1]
+        
+        parsed = self._parse_file_diff(''.join(file_parts)) if file_parts else None
+        if parsed:
+            yield parsed
+    
+    def _find_file_header(self, text, pos, end):
+        """
+        Find the next line of text[pos:end] that starts a file's diff
+        
+        A plain substring search; a multiline regex would be tried at every
+        position of the text.
+        
+        Args:
+            text (str): Raw diff text
+            pos (int): Offset to search from
+            end (int): Offset to search up to
+            
+        Returns:
+            int: Offset of the 'diff --git' header line, or -1 if there is none
+        """
+        if pos == 0 and text.startswith('diff --git ', 0, end):
+            return 0
+        index = text.find('\ndiff --git ', pos, end)
+        return index + 1 if index >= 0 else -1
+    
+    def _parse_file_diff(self, file_diff):
+        """
+        Parse the diff of a single file
         
-        return diffs
+        Args:
+            file_diff (str): Diff content for a single file, starting with its header
+            
+        Returns:
+            tuple: (file_path, diff_info) pair, or None if the header is malformed
+        """
+        header = _FILE_HEADER_RE.match(file_diff)
+        if not header:
+            return None
+        
+        # Key by the new path (the b/ side of the header)
+        return header.group(2), {
+            'content': file_diff,
+            'changes': self._extract_line_changes(file_diff)
+        }
     
-    def _extract_line_changes(self, diff_lines):
+    def _extract_line_changes(self, diff_content):
         """
         Extract line-by-line changes from diff content
         
         Args:
-            diff_lines (list): List of diff content lines
+            diff_content (str): Diff content for a single file
             
         Returns:
             list: List of dictionaries with line numbers and change types
         """
         changes = []
+        append = changes.append
         in_hunk = False
         old_line_num = 0
         new_line_num = 0
         
-        for line in diff_lines:
-            # Check if this is a hunk header
-            if line.startswith('@@'):
-                in_hunk = True
-                # Extract line numbers from hunk header
-                # Format: @@ -old_start,old_count +new_start,new_count @@
-                parts = line.split(' ')
-                if len(parts) >= 3:
-                    old_info = parts[1]
-                    new_info = parts[2]
-                    
-                    # Extract old line number
-                    if ',' in old_info:
-                        old_line_num = int(old_info[1:].split(',')[0])
-                    else:
-                        old_line_num = int(old_info[1:])
-                    
-                    # Extract new line number
-                    if ',' in new_info:
-                        new_line_num = int(new_info[1:].split(',')[0])
-                    else:
-                        new_line_num = int(new_info[1:])
+        # A trailing newline does not start another line
+        lines = diff_content.split('\n')
+        if lines[-1] == '':
+            lines.pop()
+        
+        for line in lines:
+            # The line type is fully determined by its first character, so
+            # the hunk header regex only runs on lines starting with '@'
+            first = line[:1]
+            if first == '@':
+                hunk = HUNK_RE.match(line)
+                if hunk:
+                    in_hunk = True
+                    old_line_num = int(hunk.group(1))
+                    new_line_num = int(hunk.group(2))
+                    continue
+            
+            # Skip the file header lines before the first hunk
+            if not in_hunk:
+                continue
             
-            # Process lines in a hunk
-            elif in_hunk:
-                if line.startswith('+'):
-                    # Added line
-                    changes.append({
-                        'type': 'addition',
-                        'line_num': new_line_num,
-                        'content': line[1:]
-                    })
-                    new_line_num += 1
-                elif line.startswith('-'):
-                    # Removed line
-                    changes.append({
-                        'type': 'deletion',
-                        'line_num': old_line_num,
-                        'content': line[1:]
-                    })
-                    old_line_num += 1
-                elif not line.startswith('\\'):  # Ignore "\ No newline at end of file"
-                    # Context line
-                    changes.append({
-                        'type': 'context',
-                        'old_line_num': old_line_num,
-                        'new_line_num': new_line_num,
-                        'content': line[1:]
-                    })
-                    old_line_num += 1
-                    new_line_num += 1
+            if first == '+':
+                # Added line
+                append({
+                    'type': 'addition',
+                    'line_num': new_line_num,
+                    'content': line[1:]
+                })
+                new_line_num += 1
+            elif first == '-':
+                # Removed line
+                append({
+                    'type': 'deletion',
+                    'line_num': old_line_num,
+                    'content': line[1:]
+                })
+                old_line_num += 1
+            elif first != '\\':  # Ignore "\ No newline at end of file"
+                # Context line
+                append({
+                    'type': 'context',
+                    'old_line_num': old_line_num,
+                    'new_line_num': new_line_num,
+                    'content': line[1:]
+                })
+                old_line_num += 1
+                new_line_num += 1
         
         return changes
@@ -0,0 +1,133 @@
+import os
+import time
+import asyncio
+
+# Delays between retries of a rate-limited GitHub request: 1, 2, 4, 8, 16, 32 seconds,
+# unless GitHub asks for a specific delay with Retry-After
+GITHUB_MAX_RETRIES = 6
+
+class GithubRateLimiter:
+    """
+    Tracks GitHub's X-RateLimit-* headers and holds requests back before the
+    rate limit is exhausted, instead of running into 403 responses
+    
+    GitHub budgets each resource (e.g. 'core' for REST, 'graphql') separately,
+    so the state is tracked per X-RateLimit-Resource.
+    """
+    
+    def __init__(self):
+        """
+        Initialize with the request budget to keep in reserve (GITHUB_RATE_LIMIT_BUFFER)
+        """
+        # Stop sending requests once fewer than this many remain until the reset
+        self.buffer = int(os.getenv('GITHUB_RATE_LIMIT_BUFFER', '100'))
+        
+        # Last reported {'remaining', 'reset'} per resource
+        self._rate_state = {}
+        
+        # Per resource events that are set while requests may be sent; created
+        # lazily so they bind to the event loop that sends the requests
+        self._ready = {}
+    
+    def update(self, headers):
+        """
+        Record the rate limit reported by a GitHub response
+        
+        If the remaining budget has dropped below the buffer, async requests
+        are paused until the reset time.
+        
+        Args:
+            headers (Mapping): Response headers
+        """
+        resource = headers.get('X-RateLimit-Resource')
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        if resource is None or remaining is None or reset is None:
+            return
+        
+        self._rate_state[resource] = {'remaining': int(remaining), 'reset': int(reset)}
+        
+        delay = int(reset) - time.time()
+        if int(remaining) < self.buffer and delay > 0:
+            ready = self._get_ready_event(resource)
+            if ready.is_set():
+                print(f"GitHub {resource} rate limit nearly exhausted ({remaining} left), pausing for {int(delay)}s")
+                ready.clear()
+                asyncio.get_running_loop().call_later(delay + 1, ready.set)
+    
+    async def send(self, client, method, url, resource=None, stream=False, **kwargs):
+        """
+        Send a GitHub request through an httpx client, honouring the rate limit
+        
+        Waits while the rate limit of the request's resource is paused and
+        retries rate-limited responses with exponential backoff.
+        
+        Args:
+            client (httpx.AsyncClient): Client to send the request with
+            method (str): HTTP method
+            url (str): Request URL
+            resource (str): Rate limit resource the request draws on, e.g.
+                'graphql'; None for requests outside the API quota, such as
+                raw diff downloads, which are never paused
+            stream (bool): Whether to stream the response body; the caller must
+                close streamed responses
+            **kwargs: Further arguments for httpx.AsyncClient.build_request
+        
+        Returns:
+            httpx.Response: The response
+        """
+        for attempt in range(GITHUB_MAX_RETRIES + 1):
+            if resource is not None:
+                await self._get_ready_event(resource).wait()
+            
+            response = await client.send(client.build_request(method, url, **kwargs), stream=stream)
+            self.update(response.headers)
+            
+            if not self._is_rate_limited(response) or attempt == GITHUB_MAX_RETRIES:
+                return response
+            
+            await response.aclose()
+            retry_after = response.headers.get('Retry-After')
+            delay = int(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt
+            print(f"Rate limited by GitHub ({response.status_code}), retrying in {delay}s")
+            await asyncio.sleep(delay)
+    
+    def wait_for_github(self, github):
+        """
+        Block until a PyGithub client has enough rate limit left for another request
+        
+        PyGithub only makes REST calls, so both the client's own view of the
+        rate limit and the 'core' budget last reported to this limiter by an
+        httpx response are considered, whichever leaves less.
+        
+        Args:
+            github (github.Github): PyGithub client
+        """
+        remaining, _ = github.rate_limiting
+        reset = github.rate_limiting_resettime
+        
+        # Ignore the state reported by httpx responses once its window has reset
+        now = time.time()
+        rate_state = self._rate_state.get('core')
+        if rate_state is not None and rate_state['reset'] > now and rate_state['remaining'] < remaining:
+            remaining, reset = rate_state['remaining'], rate_state['reset']
+        
+        delay = reset - now
+        if remaining < self.buffer and delay > 0:
+            print(f"GitHub rate limit nearly exhausted ({remaining} left), pausing for {int(delay)}s")
+            time.sleep(delay + 1)
+    
+    def _get_ready_event(self, resource):
+        """Get the event that is set while requests for a resource may be sent"""
+        if resource not in self._ready:
+            self._ready[resource] = asyncio.Event()
+            self._ready[resource].set()
+        return self._ready[resource]
+    
+    def _is_rate_limited(self, response):
+        """Check whether a response was rejected because of a rate limit"""
+        if response.status_code == 429:
+            return True
+        return response.status_code == 403 and (
+            response.headers.get('X-RateLimit-Remaining') == '0' or 'Retry-After' in response.headers
+        )
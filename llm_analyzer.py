@@ -1,6 +1,117 @@
 import os
+import re
 import json
+import time
+import asyncio
+import hashlib
+import threading
 import traceback
+from collections import OrderedDict
+from datetime import datetime
+
+# orjson parses LLM responses several times faster than the standard library;
+# its JSONDecodeError subclasses json.JSONDecodeError, so handlers catch both
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# Delays between retries of a rate-limited LLM request: 1, 2, 4, 8, 16, 32 seconds.
+# This is the only retry loop; the SDK clients are created with max_retries=0
+LLM_MAX_RETRIES = 6
+
+# Rate-limit response headers reporting the remaining request budget and when it
+# is replenished, per provider
+RATE_LIMIT_HEADERS = (
+    ('x-ratelimit-remaining-requests', 'x-ratelimit-reset-requests'),
+    ('anthropic-ratelimit-requests-remaining', 'anthropic-ratelimit-requests-reset'),
+)
+
+# OpenAI reports the reset as a duration such as '6m0s' or '20ms'; Anthropic as
+# an RFC 3339 timestamp
+_RESET_DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_RESET_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+SYSTEM_PROMPT = "You are a helpful code reviewer. Analyze the code changes and provide constructive feedback."
+
+# Diff excerpts sent to the LLM: windows of changed lines around each
+# addition, each line prefixed with its line number in the new file
+DIFF_WINDOW_SEPARATOR = "\n...\n"
+DIFF_EXCERPT_DESCRIPTION = (
+    "Here are the changed regions of the diff. Each line starts with its line number in the new "
+    "version of the file (blank for removed lines), followed by + for an added line, - for a removed "
+    "line or a space for an unchanged line. Regions are separated by '...':"
+)
+
+# Tokens reserved for the response (max_tokens of every request) and for the
+# fixed instructions of the prompt when packing files into a batch
+RESPONSE_TOKENS = 2000
+PROMPT_OVERHEAD_TOKENS = 500
+
+# Programming language of each recognised file extension
+LANGUAGE_BY_EXTENSION = {
+    '.py': 'Python',
+    '.js': 'JavaScript',
+    '.ts': 'TypeScript',
+    '.jsx': 'React JSX',
+    '.tsx': 'React TSX',
+    '.java': 'Java',
+    '.c': 'C',
+    '.cpp': 'C++',
+    '.cs': 'C#',
+    '.go': 'Go',
+    '.rb': 'Ruby',
+    '.php': 'PHP',
+    '.swift': 'Swift',
+    '.kt': 'Kotlin',
+    '.rs': 'Rust',
+    '.html': 'HTML',
+    '.css': 'CSS',
+    '.scss': 'SCSS',
+    '.md': 'Markdown',
+    '.json': 'JSON',
+    '.yml': 'YAML',
+    '.yaml': 'YAML',
+    '.xml': 'XML',
+    '.sh': 'Shell',
+    '.bat': 'Batch',
+    '.ps1': 'PowerShell'
+}
+
+# Only source code is worth a review request; docs, config, lock files and
+# unknown extensions are skipped without calling the LLM
+ANALYZABLE_EXTENSIONS = frozenset({
+    '.py', '.js', '.ts', '.tsx', '.jsx', '.java', '.c', '.cpp', '.cs',
+    '.go', '.rb', '.php', '.swift', '.kt', '.rs'
+})
+
+# Raw LLM responses keyed by (provider, model, sha256 of the prompts), shared by
+# every analyzer in the process so identical prompts are only sent once; only
+# responses that parsed successfully are cached
+_response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+def _response_cache_key(provider, model, system_prompt, user_prompt):
+    """Build the response cache key for a prompt"""
+    digest = hashlib.sha256(f"{model}\0{system_prompt}\0{user_prompt}".encode('utf-8')).hexdigest()
+    return (provider, model, digest)
+
+def _response_cache_get(key):
+    """Return a cached response, or None, marking it as recently used"""
+    with _response_cache_lock:
+        if key not in _response_cache:
+            return None
+        _response_cache.move_to_end(key)
+        return _response_cache[key]
+
+def _response_cache_put(key, analysis_text, max_size):
+    """Cache a response, evicting least recently used entries beyond max_size"""
+    with _response_cache_lock:
+        _response_cache[key] = analysis_text
+        _response_cache.move_to_end(key)
+        while len(_response_cache) > max_size:
+            _response_cache.popitem(last=False)
 
 class LLMAnalyzer:
     """
@@ -18,18 +129,75 @@ class LLMAnalyzer:
         self.provider = os.getenv('LLM_PROVIDER', 'openai').lower()
         self.model = os.getenv('LLM_MODEL', 'gpt-4-turbo')
         
+        # Cap on in-flight LLM requests; the semaphore is created lazily so it
+        # binds to the event loop that actually runs the analysis
+        self.max_concurrency = int(os.getenv('LLM_MAX_CONCURRENCY', '8'))
+        self._semaphore = None
+        self._requests_remaining = None
+        self._requests_reset_at = None
+        
+        # Size of the in-memory response cache, and requests currently in
+        # flight keyed by response cache key, so identical prompts issued
+        # concurrently share a single request
+        self.response_cache_size = int(os.getenv('LLM_RESPONSE_CACHE_SIZE', '1024'))
+        self._inflight = {}
+        
+        # Optional Redis cache of LLM responses shared between processes and
+        # restarts, for repeated webhooks on the same pull request; short
+        # timeouts keep a slow or unreachable Redis from stalling LLM requests
+        self.redis_cache_ttl = int(os.getenv('REDIS_CACHE_TTL', '3600'))
+        self._redis = None
+        redis_url = os.getenv('REDIS_URL')
+        if redis_url:
+            redis_timeout = float(os.getenv('REDIS_TIMEOUT', '1'))
+            try:
+                import redis.asyncio
+                self._redis = redis.asyncio.Redis.from_url(
+                    redis_url,
+                    socket_timeout=redis_timeout,
+                    socket_connect_timeout=redis_timeout
+                )
+            except ImportError:
+                print("Redis package not installed. Install with 'pip install redis' to enable the Redis response cache")
+            except ValueError as e:
+                print(f"Invalid REDIS_URL, Redis response cache disabled: {str(e)}")
+        
+        # Files with fewer added lines than this are not reviewed
+        self.min_added_lines = int(os.getenv('LLM_MIN_ADDED_LINES', '2'))
+        
+        # Only this many changed lines around each added line are sent to the LLM
+        self.diff_context_lines = int(os.getenv('LLM_DIFF_CONTEXT_LINES', '20'))
+        
+        # Small files are sent to the LLM together, up to batch_max_files files
+        # and as many tokens as fit in the context next to the response; larger
+        # files are split into several requests of at most that size
+        self.batch_max_files = int(os.getenv('LLM_BATCH_MAX_FILES', '5'))
+        self.prompt_token_budget = (int(os.getenv('LLM_MAX_CONTEXT_TOKENS', '16000'))
+                                   - RESPONSE_TOKENS - PROMPT_OVERHEAD_TOKENS)
+        
+        # Token counting for batching; falls back to a characters / 4 estimate
+        # when tiktoken is not installed or has no encoding available
+        try:
+            import tiktoken
+            try:
+                self._encoding = tiktoken.encoding_for_model(self.model)
+            except KeyError:
+                self._encoding = tiktoken.get_encoding('cl100k_base')
+        except Exception:
+            self._encoding = None
+        
         # Initialize the appropriate client based on the provider
         if self.provider == 'openai':
             try:
-                from openai import OpenAI
-                self.client = OpenAI(api_key=api_key)
+                from openai import AsyncOpenAI
+                self.client = AsyncOpenAI(api_key=api_key, max_retries=0)
             except Exception as e:
                 print(f"Error initializing OpenAI client: {str(e)}")
                 raise e
         elif self.provider == 'anthropic':
             try:
-                from anthropic import Anthropic
-                self.client = Anthropic(api_key=api_key)
+                from anthropic import AsyncAnthropic
+                self.client = AsyncAnthropic(api_key=api_key, max_retries=0)
             except ImportError as e:
                 print("Anthropic package not installed. Install with 'pip install anthropic'")
                 raise e
@@ -49,15 +217,16 @@ class LLMAnalyzer:
                 raise e
         elif self.provider == 'azure_openai':
             try:
-                from openai import AzureOpenAI
+                from openai import AsyncAzureOpenAI
                 azure_endpoint = os.getenv('AZURE_OPENAI_ENDPOINT')
                 if not azure_endpoint:
                     print("AZURE_OPENAI_ENDPOINT environment variable is required for Azure OpenAI")
                     raise ValueError("AZURE_OPENAI_ENDPOINT environment variable is required for Azure OpenAI")
-                self.client = AzureOpenAI(
+                self.client = AsyncAzureOpenAI(
                     api_key=api_key,
                     api_version=os.getenv('AZURE_OPENAI_API_VERSION', '2023-05-15'),
-                    azure_endpoint=azure_endpoint
+                    azure_endpoint=azure_endpoint,
+                    max_retries=0
                 )
             except Exception as e:
                 print(f"Error initializing Azure OpenAI client: {str(e)}")
@@ -66,32 +235,170 @@ class LLMAnalyzer:
             print(f"Unsupported LLM provider: {self.provider}")
             raise ValueError(f"Unsupported LLM provider: {self.provider}")
     
-    def analyze_diffs(self, diffs):
+    async def analyze_diffs_async(self, diffs):
         """
-        Analyze diffs using OpenAI's API
+        Analyze diffs concurrently, packing small files into shared LLM requests
+        
+        The analyzer's semaphore and async clients bind to the event loop of
+        its first analysis, so every call must run on that same loop.
+        
+        When given a stream of files, each batch's request is started as soon as
+        the batch is full, so analysis overlaps with the diff download. If the
+        stream fails, the batches already started are cancelled.
         
         Args:
-            diffs (dict): Dictionary with file paths as keys and diff content as values
+            diffs (dict or async iterable): Dictionary with file paths as keys and diff
+                content as values, or an async iterable of (file_path, diff_info) pairs
             
         Returns:
             dict: Dictionary with file paths as keys and analysis results as values
         """
-        results = {}
+        batches = []
+        tasks = []
+        batch = []
+        batch_tokens = 0
         
-        for file_path, diff_info in diffs.items():
-            # Skip binary files or files without changes
-            if not diff_info.get('changes'):
+        try:
+            async for file_path, diff_info in self._iter_diffs(diffs):
+                # Skip binary files, non-code files and files with too few added lines
+                additions = [change for change in diff_info.get('changes', [])
+                            if change.get('type') == 'addition']
+                if not self._should_analyze(file_path, additions):
+                    continue
+                
+                # Start the current batch once it is full or this file would not fit;
+                # a file larger than the budget ends up in a batch of its own
+                tokens = self._count_tokens(DIFF_WINDOW_SEPARATOR.join(self._create_diff_windows(diff_info['changes'])))
+                if batch and (len(batch) >= self.batch_max_files or batch_tokens + tokens > self.prompt_token_budget):
+                    batches.append(batch)
+                    tasks.append(asyncio.ensure_future(self._analyze_batch_async(batch)))
+                    batch = []
+                    batch_tokens = 0
+                
+                batch.append((file_path, diff_info))
+                batch_tokens += tokens
+        except BaseException:
+            # Stop the requests of the batches already started
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        
+        if batch:
+            batches.append(batch)
+            tasks.append(asyncio.ensure_future(self._analyze_batch_async(batch)))
+        
+        results = {}
+        for batch, batch_analysis in zip(batches, await asyncio.gather(*tasks, return_exceptions=True)):
+            if isinstance(batch_analysis, BaseException):
+                for file_path, _ in batch:
+                    print(f"Error analyzing file {file_path} with {self.provider}: {str(batch_analysis)}")
                 continue
             
-            # Analyze each file's changes
-            file_analysis = self._analyze_file_diff(file_path, diff_info)
-            
-            if file_analysis:
-                results[file_path] = file_analysis
+            for file_path, file_analysis in batch_analysis.items():
+                if file_analysis:
+                    results[file_path] = file_analysis
         
         return results
     
-    def _analyze_file_diff(self, file_path, diff_info):
+    async def _analyze_batch_async(self, batch):
+        """
+        Analyze several files' diffs with a single LLM request
+        
+        Falls back to one request per file if the combined request fails or
+        its response cannot be parsed.
+        
+        Args:
+            batch (list): List of (file_path, diff_info) pairs
+            
+        Returns:
+            dict: Dictionary with file paths as keys and lists of comments as values
+        """
+        if len(batch) > 1:
+            files = []
+            for file_path, diff_info in batch:
+                _, ext = os.path.splitext(file_path)
+                diff_excerpt = DIFF_WINDOW_SEPARATOR.join(self._create_diff_windows(diff_info['changes']))
+                files.append((file_path, self._get_language_from_extension(ext), diff_excerpt))
+            
+            prompt = self._create_batch_analysis_prompt(files)
+            file_paths = [file_path for file_path, _ in batch]
+            try:
+                batch_analysis = await self._complete(
+                    SYSTEM_PROMPT, prompt, lambda analysis_text: self._parse_batch_response(analysis_text, file_paths)
+                )
+                if batch_analysis is not None:
+                    return batch_analysis
+            except Exception as e:
+                traceback.print_exc()
+                print(f"Error analyzing batch of {len(batch)} files with {self.provider}: {str(e)}")
+        
+        file_analyses = await asyncio.gather(*[
+            self._analyze_file_diff_async(file_path, diff_info) for file_path, diff_info in batch
+        ])
+        return {file_path: file_analysis for (file_path, _), file_analysis in zip(batch, file_analyses)}
+    
+    def _should_analyze(self, file_path, additions):
+        """
+        Check whether a file's changes are worth sending to the LLM
+        
+        Args:
+            file_path (str): Path to the file
+            additions (list): List of added lines
+            
+        Returns:
+            bool: True if the file is source code with enough added lines
+        """
+        _, ext = os.path.splitext(file_path)
+        return ext.lower() in ANALYZABLE_EXTENSIONS and len(additions) >= max(self.min_added_lines, 1)
+    
+    def _truncate_to_tokens(self, text, max_tokens):
+        """
+        Cut text down to at most max_tokens tokens
+        
+        Args:
+            text (str): Text to truncate
+            max_tokens (int): Maximum number of tokens to keep
+            
+        Returns:
+            str: Truncated text
+        """
+        if self._encoding is not None:
+            return self._encoding.decode(self._encoding.encode(text, disallowed_special=())[:max_tokens])
+        return text[:max_tokens * 4]
+    
+    def _count_tokens(self, text):
+        """
+        Count or estimate the number of tokens in a piece of text
+        
+        Args:
+            text (str): Text to measure
+            
+        Returns:
+            int: Number of tokens
+        """
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return len(text) // 4
+    
+    async def _iter_diffs(self, diffs):
+        """
+        Iterate over (file_path, diff_info) pairs from a dict or an async stream
+        
+        Args:
+            diffs (dict or async iterable): Diff source passed to analyze_diffs_async
+            
+        Yields:
+            tuple: (file_path, diff_info) pairs
+        """
+        if isinstance(diffs, dict):
+            for item in diffs.items():
+                yield item
+        else:
+            async for item in diffs:
+                yield item
+    
+    async def _analyze_file_diff_async(self, file_path, diff_info):
         """
         Analyze a single file's diff
         
@@ -106,95 +413,383 @@ class LLMAnalyzer:
         additions = [change for change in diff_info.get('changes', []) 
                     if change.get('type') == 'addition']
         
-        if not additions:
+        if not self._should_analyze(file_path, additions):
             return []
         
         # Get file extension to determine language
         _, ext = os.path.splitext(file_path)
         language = self._get_language_from_extension(ext)
         
-        # Prepare the prompt for the LLM
-        prompt = self._create_analysis_prompt(file_path, language, additions, diff_info['content'])
-        system_prompt = "You are a helpful code reviewer. Analyze the code changes and provide constructive feedback."
+        # Prepare the prompts for the LLM; a file too large for one prompt is
+        # split into several that are analyzed concurrently
+        windows = self._create_diff_windows(diff_info['changes'])
+        prompts = [
+            self._create_analysis_prompt(file_path, language, additions, diff_excerpt)
+            for diff_excerpt in self._chunk_diff_windows(windows)
+        ]
+        
+        def parse(analysis_text):
+            return self._parse_analysis_response(analysis_text, additions)
         
-        # Call the appropriate LLM API based on the provider
         try:
+            analyses = await asyncio.gather(*[self._complete(SYSTEM_PROMPT, prompt, parse) for prompt in prompts])
+        except Exception as e:
+            traceback.print_exc()
+            print(f"Error analyzing file {file_path} with {self.provider}: {str(e)}")
+            return []
+        
+        comments = []
+        for analysis in analyses:
+            comments.extend(analysis or [])
+        return comments
+    
+    def _create_diff_windows(self, changes):
+        """
+        Render the changed lines surrounding each added line
+        
+        Every added line is shown with diff_context_lines changed lines on
+        either side; overlapping windows are merged. Each rendered line starts
+        with its line number in the new file so the LLM can refer to it.
+        
+        Args:
+            changes (list): List of line changes from the parsed diff
+            
+        Returns:
+            list: Rendered windows in file order
+        """
+        ranges = []
+        for i, change in enumerate(changes):
+            if change.get('type') != 'addition':
+                continue
+            
+            start = max(i - self.diff_context_lines, 0)
+            end = min(i + self.diff_context_lines + 1, len(changes))
+            if ranges and start <= ranges[-1][1]:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+        
+        return ['\n'.join(self._format_change(change) for change in changes[start:end]) for start, end in ranges]
+    
+    def _format_change(self, change):
+        """Render a single line change as '<new line number> <+|-| ><content>'"""
+        if change['type'] == 'addition':
+            return f"{change['line_num']:>6} +{change['content']}"
+        if change['type'] == 'deletion':
+            return f"{'':>6} -{change['content']}"
+        return f"{change['new_line_num']:>6}  {change['content']}"
+    
+    def _chunk_diff_windows(self, windows):
+        """
+        Group diff windows into excerpts that each fit in the prompt token budget
+        
+        Args:
+            windows (list): Rendered windows from _create_diff_windows
+            
+        Returns:
+            list: Diff excerpts, one per prompt
+        """
+        chunks = []
+        chunk = []
+        chunk_tokens = 0
+        
+        for window in windows:
+            # A window larger than the budget, such as a whole newly added file,
+            # is split into several pieces that each get a prompt of their own
+            tokens = self._count_tokens(window)
+            pieces = self._split_window(window) if tokens > self.prompt_token_budget else [(window, tokens)]
+            
+            for piece, tokens in pieces:
+                if chunk and chunk_tokens + tokens > self.prompt_token_budget:
+                    chunks.append(DIFF_WINDOW_SEPARATOR.join(chunk))
+                    chunk = []
+                    chunk_tokens = 0
+                
+                chunk.append(piece)
+                chunk_tokens += tokens
+        
+        if chunk:
+            chunks.append(DIFF_WINDOW_SEPARATOR.join(chunk))
+        
+        return chunks
+    
+    def _split_window(self, window):
+        """
+        Split a diff window on line boundaries into pieces that each fit in the
+        prompt token budget
+        
+        Args:
+            window (str): Rendered window from _create_diff_windows
+            
+        Returns:
+            list: (piece, tokens) pairs in file order
+        """
+        pieces = []
+        piece = []
+        piece_tokens = 0
+        
+        for line in window.split('\n'):
+            # Count the line's terminating newline as well
+            tokens = self._count_tokens(line) + 1
+            if tokens > self.prompt_token_budget:
+                # Only a single line longer than the whole budget is cut off
+                line = self._truncate_to_tokens(line, self.prompt_token_budget - 1)
+                tokens = self.prompt_token_budget
+            
+            if piece and piece_tokens + tokens > self.prompt_token_budget:
+                pieces.append(('\n'.join(piece), piece_tokens))
+                piece = []
+                piece_tokens = 0
+            
+            piece.append(line)
+            piece_tokens += tokens
+        
+        if piece:
+            pieces.append(('\n'.join(piece), piece_tokens))
+        
+        return pieces
+    
+    async def _complete(self, system_prompt, user_prompt, parse):
+        """
+        Get the LLM's parsed response to a prompt, reusing the response to an
+        identical earlier or in-flight prompt when there is one
+        
+        Responses are only cached if parse accepts them, so a malformed answer
+        is requested again next time instead of being served from the cache.
+        
+        Args:
+            system_prompt (str): System prompt
+            user_prompt (str): User prompt
+            parse (callable): Parses the raw response text, returning None if
+                the response is malformed
+            
+        Returns:
+            The parsed response, or None if it could not be parsed
+        """
+        key = _response_cache_key(self.provider, self.model, system_prompt, user_prompt)
+        cached = _response_cache_get(key)
+        if cached is not None:
+            return parse(cached)
+        
+        entry = self._inflight.get(key)
+        if entry is None:
+            # Call the appropriate LLM API based on the provider
             if self.provider == 'openai':
-                return self._call_openai(system_prompt, prompt)
+                call = self._call_openai
             elif self.provider == 'anthropic':
-                return self._call_anthropic(system_prompt, prompt)
+                call = self._call_anthropic
             elif self.provider == 'google':
-                return self._call_google(system_prompt, prompt)
+                call = self._call_google
             elif self.provider == 'azure_openai':
-                return self._call_azure_openai(system_prompt, prompt)
+                call = self._call_azure_openai
             else:
-                print(f"Unsupported LLM provider in _analyze_file_diff: {self.provider}")
+                print(f"Unsupported LLM provider in _complete: {self.provider}")
                 raise ValueError(f"Unsupported LLM provider: {self.provider}")
+            
+            task = asyncio.ensure_future(self._fetch_response(key, call, system_prompt, user_prompt, parse))
+            entry = self._inflight[key] = {'task': task, 'waiters': 0}
+            
+            def finish(done):
+                self._inflight.pop(key, None)
+                if not done.cancelled() and done.exception() is None:
+                    analysis_text, analysis = done.result()
+                    if analysis is not None:
+                        _response_cache_put(key, analysis_text, self.response_cache_size)
+            
+            task.add_done_callback(finish)
+        
+        # Shield the shared request so one cancelled waiter does not cancel it
+        # for the others; it is only cancelled once nobody waits for it
+        task = entry['task']
+        entry['waiters'] += 1
+        try:
+            _, analysis = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if entry['waiters'] == 1:
+                task.cancel()
+            raise
+        finally:
+            entry['waiters'] -= 1
+        return analysis
+    
+    async def _fetch_response(self, key, call, system_prompt, user_prompt, parse):
+        """
+        Get a response from the Redis cache, or from the LLM if it is not cached there
+        
+        Redis errors are logged and treated as cache misses, so an unavailable
+        Redis never fails the analysis. Only responses that parse are written
+        to Redis.
+        
+        Args:
+            key (tuple): Response cache key of the prompt
+            call (callable): One of the _call_<provider> coroutines
+            system_prompt (str): System prompt
+            user_prompt (str): User prompt
+            parse (callable): Parses the raw response text, returning None if
+                the response is malformed
+            
+        Returns:
+            tuple: (raw response text, parsed response or None)
+        """
+        if self._redis is None:
+            analysis_text = await self._call_with_backoff(call, system_prompt, user_prompt)
+            return analysis_text, parse(analysis_text)
+        
+        redis_key = 'pr_agent:llm:' + ':'.join(key)
+        try:
+            cached = await self._redis.get(redis_key)
+            if cached is not None:
+                analysis_text = cached.decode('utf-8')
+                analysis = parse(analysis_text)
+                if analysis is not None:
+                    return analysis_text, analysis
         except Exception as e:
-            traceback.print_exc()
-            print(f"Error analyzing file {file_path} with {self.provider}: {str(e)}")
-            return []
+            print(f"Failed to read LLM response from Redis: {str(e)}")
+        
+        analysis_text = await self._call_with_backoff(call, system_prompt, user_prompt)
+        analysis = parse(analysis_text)
+        
+        if analysis is not None:
+            try:
+                await self._redis.setex(redis_key, self.redis_cache_ttl, analysis_text)
+            except Exception as e:
+                print(f"Failed to write LLM response to Redis: {str(e)}")
+        
+        return analysis_text, analysis
+    
+    async def _call_with_backoff(self, call, system_prompt, user_prompt):
+        """
+        Run a provider call under the concurrency semaphore, retrying rate-limited
+        requests with exponential backoff
+        
+        Args:
+            call (callable): One of the _call_<provider> coroutines
+            system_prompt (str): System prompt
+            user_prompt (str): User prompt
+            
+        Returns:
+            str: Raw response text from the LLM
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            # Slow down before the provider starts rejecting requests, without
+            # holding a semaphore slot while waiting
+            delay = self._rate_limit_delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            
+            async with self._semaphore:
+                try:
+                    return await call(system_prompt, user_prompt)
+                except Exception as e:
+                    if not self._is_rate_limit_error(e) or attempt == LLM_MAX_RETRIES:
+                        raise e
+            
+            # Back off outside the semaphore so the slot is not held while sleeping
+            delay = 2 ** attempt
+            print(f"Rate limited by {self.provider}, retrying in {delay}s")
+            await asyncio.sleep(delay)
+    
+    def _is_rate_limit_error(self, error):
+        """Check whether a provider exception is a rate-limit rejection"""
+        return (getattr(error, 'status_code', None) == 429
+                or type(error).__name__ in ('RateLimitError', 'ResourceExhausted'))
+    
+    def _record_rate_limit(self, headers):
+        """Remember the remaining request budget reported by the provider and when it resets"""
+        for remaining_header, reset_header in RATE_LIMIT_HEADERS:
+            value = headers.get(remaining_header)
+            if value is not None and value.isdigit():
+                self._requests_remaining = int(value)
+                reset_in = self._parse_reset(headers.get(reset_header))
+                self._requests_reset_at = time.time() + reset_in if reset_in is not None else None
+                return
+    
+    def _parse_reset(self, value):
+        """Convert a rate-limit reset header into seconds from now, or None if it is missing or malformed"""
+        if not value:
+            return None
+        
+        parts = _RESET_DURATION_RE.findall(value)
+        if parts and ''.join(number + unit for number, unit in parts) == value:
+            return sum(float(number) * _RESET_DURATION_UNITS[unit] for number, unit in parts)
+        
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp() - time.time()
+        except ValueError:
+            return None
+    
+    def _rate_limit_delay(self):
+        """Seconds to wait before the next request when the request budget is nearly exhausted"""
+        if self._requests_remaining is None or self._requests_remaining >= self.max_concurrency:
+            return 0
+        if self._requests_reset_at is None:
+            # The provider did not say when the budget resets
+            return 1
+        return max(self._requests_reset_at - time.time(), 0)
     
-    def _call_openai(self, system_prompt, user_prompt):
+    async def _call_openai(self, system_prompt, user_prompt):
         """Call OpenAI API"""
-        response = self.client.chat.completions.create(
+        raw_response = await self.client.chat.completions.with_raw_response.create(
             model=self.model,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt}
             ],
             temperature=0.3,
-            max_tokens=2000
+            max_tokens=RESPONSE_TOKENS
         )
+        self._record_rate_limit(raw_response.headers)
+        response = raw_response.parse()
         
-        analysis_text = response.choices[0].message.content
-        return self._parse_analysis_response(analysis_text, [])
+        return response.choices[0].message.content
     
-    def _call_anthropic(self, system_prompt, user_prompt):
+    async def _call_anthropic(self, system_prompt, user_prompt):
         """Call Anthropic API"""
-        combined_prompt = f"{system_prompt}\n\n{user_prompt}"
-        response = self.client.messages.create(
+        raw_response = await self.client.messages.with_raw_response.create(
             model=self.model,
-            max_tokens=2000,
+            max_tokens=RESPONSE_TOKENS,
             temperature=0.3,
             system=system_prompt,
             messages=[
                 {"role": "user", "content": user_prompt}
             ]
         )
+        self._record_rate_limit(raw_response.headers)
+        response = raw_response.parse()
         
-        analysis_text = response.content[0].text
-        return self._parse_analysis_response(analysis_text, [])
+        return response.content[0].text
     
-    def _call_google(self, system_prompt, user_prompt):
+    async def _call_google(self, system_prompt, user_prompt):
         """Call Google Generative AI API"""
         combined_prompt = f"{system_prompt}\n\n{user_prompt}"
-        response = self.client.generate_text(
-            model=self.model,
-            prompt=combined_prompt,
-            temperature=0.3,
-            max_output_tokens=2000,
+        model = self.client.GenerativeModel(self.model)
+        response = await model.generate_content_async(
+            combined_prompt,
+            generation_config={'temperature': 0.3, 'max_output_tokens': RESPONSE_TOKENS},
         )
         
-        analysis_text = response.text
-        return self._parse_analysis_response(analysis_text, [])
+        return response.text
     
-    def _call_azure_openai(self, system_prompt, user_prompt):
+    async def _call_azure_openai(self, system_prompt, user_prompt):
         """Call Azure OpenAI API"""
-        response = self.client.chat.completions.create(
+        raw_response = await self.client.chat.completions.with_raw_response.create(
             model=self.model,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt}
             ],
             temperature=0.3,
-            max_tokens=2000
+            max_tokens=RESPONSE_TOKENS
         )
+        self._record_rate_limit(raw_response.headers)
+        response = raw_response.parse()
         
-        analysis_text = response.choices[0].message.content
-        return self._parse_analysis_response(analysis_text, [])
+        return response.choices[0].message.content
     
-    def _create_analysis_prompt(self, file_path, language, additions, full_diff):
+    def _create_analysis_prompt(self, file_path, language, additions, diff_excerpt):
         """
         Create a prompt for the LLM to analyze the diff
         
@@ -202,7 +797,7 @@ class LLMAnalyzer:
             file_path (str): Path to the file
             language (str): Programming language of the file
             additions (list): List of added lines
-            full_diff (str): Full diff content
+            diff_excerpt (str): Changed regions of the diff, from _create_diff_windows
             
         Returns:
             str: Prompt for the LLM
@@ -210,9 +805,9 @@ class LLMAnalyzer:
         prompt = f"""
 Analyze the following code changes in the file `{file_path}` ({language}).
 
-Here's the full diff:
+{DIFF_EXCERPT_DESCRIPTION}
 ```diff
-{full_diff}
+{diff_excerpt}
 ```
 
 Focus on the added lines and provide specific, actionable feedback on:
@@ -240,6 +835,106 @@ Only include comments that are valuable and actionable. If there are no issues t
 """
         return prompt
     
+    def _create_batch_analysis_prompt(self, files):
+        """
+        Create a prompt for the LLM to analyze several files' diffs at once
+        
+        Args:
+            files (list): List of (file_path, language, diff_excerpt) tuples
+            
+        Returns:
+            str: Prompt for the LLM
+        """
+        file_sections = "\n".join(
+            f"""### `{file_path}` ({language})
+```diff
+{diff_excerpt}
+```
+"""
+            for file_path, language, diff_excerpt in files
+        )
+        
+        prompt = f"""
+Analyze the following code changes in {len(files)} files.
+
+{DIFF_EXCERPT_DESCRIPTION}
+
+{file_sections}
+Focus on the added lines and provide specific, actionable feedback on:
+1. Code quality issues
+2. Potential bugs or edge cases
+3. Performance concerns
+4. Security vulnerabilities
+5. Best practices and style improvements
+
+For each issue, specify:
+1. The line number
+2. A clear description of the issue
+3. A suggested improvement
+
+Format your response as a JSON object mapping each file path to an array of objects with the following structure:
+{{
+  "path/to/file": [
+    {{
+      "line": <line_number>,
+      "content": "Your comment here"
+    }},
+    ...
+  ],
+  ...
+}}
+
+Include every file path as a key. Only include comments that are valuable and actionable. If a file has no issues to report, map it to an empty array [].
+"""
+        return prompt
+    
+    def _parse_batch_response(self, analysis_text, file_paths):
+        """
+        Parse the LLM's response to a batch prompt into a structured format
+        
+        Args:
+            analysis_text (str): Raw response from the LLM
+            file_paths (list): Paths of the files in the batch
+            
+        Returns:
+            dict: Dictionary with file paths as keys and lists of comments as values,
+                or None if the response is not a JSON object mapping every file
+                in the batch to a list
+        """
+        try:
+            # Extract JSON from the response
+            # The LLM might include explanatory text before or after the JSON
+            json_start = analysis_text.find('{')
+            json_end = analysis_text.rfind('}') + 1
+            
+            if json_start < 0 or json_end <= json_start:
+                return None
+            
+            file_comments = _json_loads(analysis_text[json_start:json_end])
+            if not isinstance(file_comments, dict):
+                return None
+            
+            # Validate the structure, ignoring paths that were not in the batch;
+            # a response missing any requested file is treated as unparseable,
+            # so those files are analyzed on their own instead of skipped
+            results = {}
+            for file_path in file_paths:
+                comments = file_comments.get(file_path)
+                if not isinstance(comments, list):
+                    print(f"Batch response has no comment list for {file_path}")
+                    return None
+                results[file_path] = [
+                    comment for comment in comments
+                    if isinstance(comment, dict) and 'line' in comment and 'content' in comment
+                ]
+            
+            return results
+            
+        except json.JSONDecodeError:
+            traceback.print_exc()
+            print(f"Failed to parse JSON response: {analysis_text}")
+            return None
+    
     def _parse_analysis_response(self, analysis_text, additions):
         """
         Parse the LLM's response into a structured format
@@ -249,7 +944,7 @@ Only include comments that are valuable and actionable. If there are no issues t
             additions (list): List of added lines
             
         Returns:
-            list: List of comments
+            list: List of comments, or None if the response is not a JSON array
         """
         try:
             # Extract JSON from the response
@@ -259,7 +954,9 @@ Only include comments that are valuable and actionable. If there are no issues t
             
             if json_start >= 0 and json_end > json_start:
                 json_str = analysis_text[json_start:json_end]
-                comments = json.loads(json_str)
+                comments = _json_loads(json_str)
+                if not isinstance(comments, list):
+                    return None
                 
                 # Validate the structure
                 valid_comments = []
@@ -269,14 +966,13 @@ Only include comments that are valuable and actionable. If there are no issues t
                 
                 return valid_comments
             
-            return []
+            return None
             
         except json.JSONDecodeError:
-            # If JSON parsing fails, try to extract comments in a different way
-            # This is a fallback in case the LLM doesn't format the response as requested
+            # The LLM did not format the response as requested
             traceback.print_exc()
             print(f"Failed to parse JSON response: {analysis_text}")
-            return []
+            return None
     
     def _get_language_from_extension(self, extension):
         """
@@ -288,33 +984,4 @@ Only include comments that are valuable and actionable. If there are no issues t
         Returns:
             str: Programming language name
         """
-        extension_map = {
-            '.py': 'Python',
-            '.js': 'JavaScript',
-            '.ts': 'TypeScript',
-            '.jsx': 'React JSX',
-            '.tsx': 'React TSX',
-            '.java': 'Java',
-            '.c': 'C',
-            '.cpp': 'C++',
-            '.cs': 'C#',
-            '.go': 'Go',
-            '.rb': 'Ruby',
-            '.php': 'PHP',
-            '.swift': 'Swift',
-            '.kt': 'Kotlin',
-            '.rs': 'Rust',
-            '.html': 'HTML',
-            '.css': 'CSS',
-            '.scss': 'SCSS',
-            '.md': 'Markdown',
-            '.json': 'JSON',
-            '.yml': 'YAML',
-            '.yaml': 'YAML',
-            '.xml': 'XML',
-            '.sh': 'Shell',
-            '.bat': 'Batch',
-            '.ps1': 'PowerShell'
-        }
-        
-        return extension_map.get(extension.lower(), 'Unknown')
+        return LANGUAGE_BY_EXTENSION.get(extension.lower(), 'Unknown')